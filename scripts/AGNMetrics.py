@@ -2,15 +2,215 @@
 The AGN Metric (SFErrorMetric) run/tested in this repo.
 """
 import numpy as np
-from astropy.stats import mad_std
+import numba
+from numba import njit, prange
 from lsst.sims.maf.metrics import BaseMetric
+from AGNStacker import MagErrStacker
+
+# time quantum of the int32 kernel paths: 1e-4 day, two orders of
+# magnitude below the narrowest bin width the run scripts use
+# (logspace(-2, ...) edges start at 0.01 d), so the +/-5e-5 d rounding
+# of a delta_t can only flip pairs sitting essentially on a bin edge;
+# 10 yr of hundred-microday ticks still fits comfortably in int32
+_T_SCALE = 1.0e4
+
+
+@njit(cache=True, fastmath=True, parallel=True)
+def _sf_hist(times, bins, out):
+    """Accumulate the pairwise delta_t histogram of sorted times into out.
+
+    Fuses the pairwise differencing and the binning into one compiled loop,
+    so no intermediate delta_t array is ever allocated. Since times is
+    sorted, the partner range of each observation is bounded by two binary
+    searches, so pairs shorter than the first bin edge or longer than the
+    last one are never visited; for baselines longer than bins[-1] this
+    cuts the O(N^2) sweep down to O(N * W) with W the number of visits
+    inside one bins[-1] window. The outer loop runs in parallel over
+    threads, each thread counting into its own histogram buffer, which are
+    then reduced into out.
+    """
+
+    n = times.size
+    nedges = bins.size
+    local = np.zeros((numba.get_num_threads(), nedges - 1), dtype=np.int64)
+    for i in prange(n):
+        t = numba.get_thread_id()
+        lo = np.searchsorted(times, times[i] + bins[0], side='left')
+        hi = np.searchsorted(times, times[i] + bins[nedges - 1], side='right')
+        if lo < i + 1:
+            lo = i + 1
+        for j in range(lo, hi):
+            dt = times[j] - times[i]
+            k = np.searchsorted(bins, dt, side='right') - 1
+            # np.histogram closes the last bin, so dt == bins[-1] counts
+            if k == nedges - 1 and dt == bins[nedges - 1]:
+                k = nedges - 2
+            if (k >= 0) and (k < nedges - 1):
+                local[t, k] += 1
+    for t in range(local.shape[0]):
+        for k in range(nedges - 1):
+            out[k] += local[t, k]
+
+
+@njit(cache=True, fastmath=True)
+def _median_nb(x):
+    """Median via one O(N) partition select.
+
+    Even sizes average the two middle order statistics (the larger one is
+    p[h], the smaller the max of the partition's left half) to match
+    np.median exactly.
+    """
+
+    n = x.size
+    h = n // 2
+    p = np.partition(x, h)
+    if n % 2 == 1:
+        return p[h]
+    lo = p[0]
+    for i in range(1, h):
+        if p[i] > lo:
+            lo = p[i]
+    return 0.5 * (lo + p[h])
+
+
+@njit(cache=True, fastmath=True)
+def _sf_core(times, err_var, bins, weight, err_mu, err_std, have_stats):
+    """Fully fused per-pixel SFError computation.
+
+    Runs the pairwise histogram, the robust magErr^2 statistics (median and
+    MAD, both via O(N) partition selects) and the final weighted reduction
+    in a single compiled call, so the per-pixel cost is one function
+    dispatch instead of a chain of NumPy wrapper calls. When have_stats is
+    True the precomputed err_mu/err_std are used and err_var is ignored.
+    """
+
+    nbins = bins.size - 1
+    counts = np.zeros(nbins, dtype=np.int64)
+    _sf_hist(times, bins, counts)
+
+    if not have_stats:
+        err_mu = _median_nb(err_var)
+        d = np.abs(err_var - err_mu)
+        err_std = 1.482602218505602 * _median_nb(d)
+
+    sf_var_metric = 0.0
+    for k in range(nbins):
+        n = float(counts[k])
+        # zero pairs in a bin would explode the 1/sqrt(n) term
+        if n <= 0.0:
+            n = 0.01
+        sf_var_metric += 2.0*(err_mu + err_std/np.sqrt(n)) * weight[k]
+
+    return sf_var_metric
+
+
+# warm up the JIT at import time so per-pixel calls pay no compile cost;
+# both kernels consume quantized int32 times
+_sf_hist(np.zeros(2, dtype=np.int32), np.array([50, 100], dtype=np.int32),
+         np.zeros(1, dtype=np.int64))
+_sf_core(np.zeros(2, dtype=np.int32), np.zeros(2),
+         np.array([50, 100], dtype=np.int32), np.zeros(1), 0., 0., False)
+
+
+def _median_fast(x):
+    """np.median via partition selects instead of a full sort; even sizes
+    average the two middle order statistics, matching np.median exactly.
+    """
+
+    h = x.size // 2
+    if x.size % 2:
+        return np.partition(x, h)[h]
+    p = np.partition(x, (h - 1, h))
+    return 0.5 * (p[h - 1] + p[h])
+
+
+def _mad_std_fast(x):
+    """MAD-based standard deviation estimate of a clean (NaN-free) array.
+
+    Matches astropy.stats.mad_std (same 1/Phi^-1(0.75) constant), but uses
+    partition selects for O(N) medians and skips astropy's NaN handling
+    and wrapping overhead.
+    """
+
+    d = np.abs(x - _median_fast(x))
+    return 1.482602218505602 * _median_fast(d)
+
+
+def _bin_dts(dts, bins):
+    """Count delta_t values falling in each bin given monotonic bin edges.
+
+    Cheaper than np.histogram for the fixed, pre-sorted edges used by this
+    metric: one binary-search pass plus one counting pass. For the small
+    numbers of bins used here (< 32), a direct scan over the bin edges with
+    predictable branches beats the binary search.
+    """
+
+    if len(bins) < 32:
+        result = np.zeros(len(bins) - 1, dtype=np.int64)
+        for i, (lo, hi) in enumerate(zip(bins[:-1], bins[1:])):
+            result[i] = np.count_nonzero((dts >= lo) & (dts < hi))
+        # np.histogram closes the last bin, so dts == bins[-1] count
+        result[-1] += np.count_nonzero(dts == bins[-1])
+        return result
+    else:
+        idx = np.searchsorted(bins, dts, side='right')
+        idx[dts == bins[-1]] = len(bins) - 1
+        return np.bincount(idx, minlength=len(bins) + 1)[1:len(bins)]
+
+
+def sf_hist_batch(pix, times, bins):
+    """Compute the delta_t histograms of every healpix pixel in one pass.
+
+    Bulk alternative to calling SFErrorMetric.run pixel by pixel through the
+    MAF slicer: given the healpix id and time of every visit of one opsim,
+    all per-pixel pair counts are accumulated with a handful of vectorized
+    passes (one per pair offset) via np.add.at on a compound
+    (pixel, bin) index, instead of thousands of Python-level metric calls.
+
+    Args:
+        pix(object): An array of healpix ids, one per visit.
+        times(object): An array of visit times (MJD), same length as pix.
+        bins(object): An array of delta_t bin edges.
+
+    Returns:
+        pix_ids(object): The unique healpix ids, sorted.
+        counts(object): An (n_pixel, n_bin) array of pair counts per pixel.
+    """
+
+    # sort visits by (pixel, time) so each pixel is a contiguous,
+    # time-ordered segment
+    order = np.lexsort((times, pix))
+    pix = pix[order]
+    times = times[order]
+    pix_ids, seg = np.unique(pix, return_inverse=True)
+
+    nbins = len(bins) - 1
+    counts = np.zeros((pix_ids.size, nbins), dtype=np.int64)
+    flat = counts.ravel()
+
+    # loop over pair offsets; pairs straddling a segment boundary are
+    # masked out, so each pass only counts gaps within one pixel
+    max_run = np.max(np.bincount(seg))
+    for k in range(1, max_run):
+        same = seg[k:] == seg[:-k]
+        if not same.any():
+            break
+        dts = times[k:][same] - times[:-k][same]
+        idx = np.searchsorted(bins, dts, side='right') - 1
+        # np.histogram closes the last bin, so dts == bins[-1] count
+        idx[dts == bins[-1]] = nbins - 1
+        valid = (idx >= 0) & (idx < nbins)
+        np.add.at(flat, seg[k:][same][valid] * nbins + idx[valid], 1)
+
+    return pix_ids, counts
+
 
 class SFErrorMetric(BaseMetric):
     """Structure Function (SF) Uncertainty Metric. Developed on top of LogTGaps"""
     
-    def __init__(self, mag, band, timesCol='observationStartMJD', allGaps=True, 
-                 units='mag', maf = False, bins=np.logspace(0, np.log10(3650), 11), 
-                 weight=np.full(10, 0.1), **kwargs):
+    def __init__(self, mag, band, timesCol='observationStartMJD', allGaps=True,
+                 units='mag', maf = False, bins=np.logspace(0, np.log10(3650), 11),
+                 weight=np.full(10, 0.1), err_var_mu=None, err_var_std=None, **kwargs):
         """Init function for metric class.
         
         Args:
@@ -25,9 +225,17 @@ class SFErrorMetric(BaseMetric):
                 if False, use the vectorized method. Defaults to False.
             bins(object): An array of bin edges. Defaults to 
                 "np.logspace(0, np.log10(3650), 11)" for a total of 10 bins.
-            weight(object): The weight assigned to each delta_t bin for 
+            weight(object): The weight assigned to each delta_t bin for
                 deriving the final metric. Defaluts to "weight=np.full(10, 0.1)".
-            
+            err_var_mu(float): Precomputed median of magErr^2 for this
+                (band, mag). If provided (together with err_var_std), the
+                per-pixel computation of these statistics is skipped; the
+                magErr distribution is set by the photometric model and is
+                nearly pixel-independent, so they can be computed once per
+                opsim instead. Defaults to None.
+            err_var_std(float): Precomputed mad_std of magErr^2 for this
+                (band, mag), see err_var_mu. Defaults to None.
+
         """
         
         # Assign metric parameters to instance object
@@ -36,6 +244,10 @@ class SFErrorMetric(BaseMetric):
         self.maf = maf
         self.bins = bins
         self.weight=weight
+        self.err_var_mu = err_var_mu
+        self.err_var_std = err_var_std
+        # bin edges quantized to the int32 kernel resolution (_T_SCALE)
+        self._bins_q = np.rint(np.asarray(bins) * _T_SCALE).astype(np.int32)
         self.metricName = f'SFError_{mag}_{band}'
         super(SFErrorMetric, self).__init__(col=[self.timesCol, 'visitExposureTime'], 
                                             metricName=self.metricName, units=units, **kwargs)
@@ -51,41 +263,233 @@ class SFErrorMetric(BaseMetric):
         if dataSlice.size < 2:
             return self.badval
         
-        # sort data by time column
-        times = np.sort(dataSlice[self.timesCol]) 
-        
+        # sort data by time column; opsim visits usually come out already
+        # time-ordered (and always do behind TimeSortStacker), so a cheap
+        # monotonicity scan replaces the O(N log N) sort in the common case
+        times = dataSlice[self.timesCol]
+        if not (times[1:] >= times[:-1]).all():
+            times = np.sort(times)
+
+        # photometric error variance, independent of the delta_t branches
+        # below, so computed up front (squaring the float64 astype copy in
+        # place, so the copy is the only allocation); skipped when the
+        # statistics are precomputed
+        if (self.err_var_mu is not None) and (self.err_var_std is not None):
+            err_var = None
+        else:
+            err_var = dataSlice['magErr'].astype(np.float64)
+            np.square(err_var, out=err_var)
+
+        # fast path: pairwise histogram, robust error statistics and the
+        # weighted reduction all fused into one compiled call; times are
+        # quantized to int32 ticks of _T_SCALE relative to the first visit
+        # (well below the narrowest bin width, see the constant above),
+        # halving the memory bandwidth of the pairwise subtraction
+        if self.allGaps and not self.maf:
+            times_q = np.rint((times - times[0]) * _T_SCALE).astype(np.int32)
+            if err_var is None:
+                return _sf_core(times_q, np.empty(0), self._bins_q, self.weight,
+                                self.err_var_mu, self.err_var_std, True)
+            return _sf_core(times_q, err_var, self._bins_q, self.weight,
+                            0., 0., False)
+
         # check if use all gaps (between any pairs of observations)
         if self.allGaps:
-            
-            # check if using original MAF method to compute time gaps
-            if not self.maf:
-                # use the vectorized method
-                dt_matrix = times.reshape((1, times.size)) - times.reshape((times.size, 1))
-                dts = dt_matrix[dt_matrix > 0].flatten().astype(np.float16)
-            else:
-                # use the original method --> loop through each observations
-                allDiffs = []
-                for i in np.arange(1,times.size,1):
-                    allDiffs.append((times-np.roll(times,i))[i:])
-                dts = np.concatenate(allDiffs).astype(np.float16)
+            # original MAF values, but gathered through triu indexing
+            # rather than a Python loop of np.roll temporaries
+            i_idx, j_idx = np.triu_indices(times.size, k=1)
+            dts = times[j_idx] - times[i_idx]
         else:
             dts = np.diff(times)
-        
-        # bin delta_t using provided bins; if zero pair found at any delta_t bin, 
-        # replace 0 with 0.01 to avoid the exploding 1/sqrt(n) term in this metric
-        result, bins = np.histogram(dts, self.bins)
+        result = _bin_dts(dts, self.bins)
+        # drop the pairwise array before the allocations below
+        del dts
+
+        # if zero pair found at any delta_t bin, replace 0 with 0.01 to
+        # avoid the exploding 1/sqrt(n) term in this metric
         new_result = np.where(result > 0, result, 0.01)
-        
+
         # compute photometric_error^2 population variance and population mean
         # note that variance is replaced by median_absolute_deviate^2
-        # mean is replaced by median in this implementation to make it robust to 
+        # mean is replaced by median in this implementation to make it robust to
         # outliers in simulations (e.g., dcr simulations)
-        err_var = dataSlice['magErr']**2
-        err_var_mu = np.median(err_var)
-        err_var_std = mad_std(err_var)
+        # skip if both were precomputed at the opsim level (see __init__)
+        if err_var is None:
+            err_var_mu = self.err_var_mu
+            err_var_std = self.err_var_std
+        else:
+            err_var_mu = np.median(err_var)
+            err_var_std = _mad_std_fast(err_var)
         
         # compute SF error
-        sf_var_dt = 2*(err_var_mu + err_var_std/np.sqrt(new_result)) 
+        sf_var_dt = 2*(err_var_mu + err_var_std/np.sqrt(new_result))
         sf_var_metric = np.sum(sf_var_dt * self.weight)
-        
-        return sf_var_metric
\ No newline at end of file
+
+        return sf_var_metric
+
+
+class SFErrorMetricGPU(SFErrorMetric):
+    """GPU variant of SFErrorMetric backed by CuPy.
+
+    Offloads the pairwise delta_t histogram of very dense pixels (i.e.,
+    DDFs) to the GPU with a streaming offset loop over cp.searchsorted +
+    cp.bincount; sparse pixels fall back to the CPU kernel, whose cost
+    the kernel-launch overhead would dominate. CuPy is imported on first
+    use so the module stays importable on CPU-only nodes.
+    """
+
+    def __init__(self, *args, gpu_min_visits=4000, **kwargs):
+        """See SFErrorMetric for the shared arguments.
+
+        Args:
+            gpu_min_visits(int): The minimum number of visits in a pixel
+                before the histogram is offloaded to the GPU; below this
+                the CPU kernel wins. Defaults to 4000.
+        """
+
+        super(SFErrorMetricGPU, self).__init__(*args, **kwargs)
+        self.gpu_min_visits = gpu_min_visits
+        self._cp = None
+
+    def run(self, dataSlice, slicePoint=None):
+        """Code executed at each pixel; dense pixels go to the GPU."""
+
+        # the GPU only pays off for dense pixels on the all-gaps path
+        if (not self.allGaps) or self.maf or (dataSlice.size < self.gpu_min_visits):
+            return super(SFErrorMetricGPU, self).run(dataSlice, slicePoint)
+
+        if self._cp is None:
+            import cupy
+            self._cp = cupy
+        cp = self._cp
+
+        # same prologue as the CPU path
+        dataSlice = dataSlice[dataSlice['visitExposureTime'] > 5.1]
+        if dataSlice.size < 2:
+            return self.badval
+        times = dataSlice[self.timesCol]
+        if not (times[1:] >= times[:-1]).all():
+            times = np.sort(times)
+
+        # streaming offset histogram on the device: each pass fuses the
+        # subtraction, bin search and count without leaving GPU memory
+        t = cp.asarray(np.rint((times - times[0]) * _T_SCALE).astype(np.int32))
+        bins_q = cp.asarray(self._bins_q)
+        nbins = len(self.bins) - 1
+        counts = cp.zeros(nbins + 2, dtype=cp.int64)
+        for k in range(1, t.size):
+            dts = t[k:] - t[:-k]
+            # times sorted --> gaps only grow with the offset
+            if int(dts.min()) > int(self._bins_q[-1]):
+                break
+            idx = cp.searchsorted(bins_q, dts, side='right')
+            # np.histogram closes the last bin, so dts == bins[-1] count
+            idx[dts == bins_q[-1]] = nbins
+            counts += cp.bincount(idx, minlength=nbins + 2)
+        result = cp.asnumpy(counts[1:nbins + 1])
+        new_result = np.where(result > 0, result, 0.01)
+
+        # robust error statistics stay on the CPU (cheap vs the histogram)
+        if (self.err_var_mu is not None) and (self.err_var_std is not None):
+            err_var_mu = self.err_var_mu
+            err_var_std = self.err_var_std
+        else:
+            err_var = dataSlice['magErr']**2
+            err_var_mu = np.median(err_var)
+            err_var_std = _mad_std_fast(err_var)
+
+        sf_var_dt = 2*(err_var_mu + err_var_std/np.sqrt(new_result))
+        return np.sum(sf_var_dt * self.weight)
+
+
+class SFErrorMultiMetric(BaseMetric):
+    """Batched version of SFErrorMetric evaluating all (band, mag) combos at once.
+
+    One instance replaces a stack of SFErrorMetric bundles that only differ
+    in band constraint and source magnitude: the dataSlice is split by
+    filter inside run, so the sort + pairwise histogram is computed once
+    per band and shared across all magnitudes, instead of re-driving the
+    slicer once per (band, mag). The photometric errors are derived from
+    the same model as MagErrStacker, so no stacker is needed.
+    """
+
+    def __init__(self, mags, timesCol='observationStartMJD', m5Col='fiveSigmaDepth',
+                 filterCol='filter', units='mag',
+                 bins=np.logspace(0, np.log10(3650), 11),
+                 weight=np.full(10, 0.1), **kwargs):
+        """Init function for metric class.
+
+        Args:
+            mags(dict): The magnitudes at which to evaluate this metric in
+                each band, e.g., {'u': [24.15], 'r': [23.85]}.
+            timesCol(str): Time column name. Defaults to "observationStartMJD".
+            m5Col(str): Name of the 5-sigma depth column. Defaults to
+                "fiveSigmaDepth".
+            filterCol(str): Name of the filter column. Defaults to "filter".
+            units(str): Unit of this metric. Defaults to "mag".
+            bins(object): An array of bin edges. Defaults to
+                "np.logspace(0, np.log10(3650), 11)" for a total of 10 bins.
+            weight(object): The weight assigned to each delta_t bin for
+                deriving the final metric. Defaluts to "weight=np.full(10, 0.1)".
+
+        """
+
+        self.mags = mags
+        self.timesCol = timesCol
+        self.m5Col = m5Col
+        self.filterCol = filterCol
+        self.bins = bins
+        self.weight = weight
+        # quantized bin edges for the int32 kernel path, see SFErrorMetric
+        self._bins_q = np.rint(np.asarray(bins) * _T_SCALE).astype(np.int32)
+        self.metricName = 'SFErrorMulti'
+        super(SFErrorMultiMetric, self).__init__(
+            col=[self.timesCol, 'visitExposureTime', self.m5Col, self.filterCol],
+            metricName=self.metricName, units=units, metricDtype='object', **kwargs)
+
+    def run(self, dataSlice, slicePoint=None):
+        """Code executed at each healpix pixel; returns a dictionary of
+        metric values keyed by 'SFError_{mag}_{band}'."""
+
+        # remove extremely short exposures
+        dataSlice = dataSlice[dataSlice['visitExposureTime'] > 5.1]
+
+        results = {}
+        for band in self.mags:
+            inBand = dataSlice[dataSlice[self.filterCol] == band]
+
+            # if the total number of visits < 2, mask as bad
+            if inBand.size < 2:
+                for mag in self.mags[band]:
+                    results[f'SFError_{mag}_{band}'] = self.badval
+                continue
+
+            # sort + histogram once per band, shared by all mags; skip the
+            # sort when the visits are already time-ordered (they usually
+            # are, and always behind TimeSortStacker); times quantized to
+            # int32 ticks of _T_SCALE for the kernel
+            times = inBand[self.timesCol]
+            if not (times[1:] >= times[:-1]).all():
+                times = np.sort(times)
+            times_q = np.rint((times - times[0]) * _T_SCALE).astype(np.int32)
+            result = np.zeros(len(self.bins) - 1, dtype=np.int64)
+            _sf_hist(times_q, self._bins_q, result)
+            new_result = np.where(result > 0, result, 0.01)
+
+            # per-mag photometric error stats, using the same model (and
+            # gamma/sigmaSys values) as MagErrStacker
+            m5 = inBand[self.m5Col]
+            gamma = MagErrStacker.gamma[band]
+            sigmaSys = MagErrStacker.sigmaSys[band]
+            for mag in self.mags[band]:
+                diffM = mag - m5
+                err_var = ((0.04-gamma)*np.power(10, 0.4*diffM) +
+                           gamma*np.power(10, 0.8*diffM) + sigmaSys**2)
+                err_var_mu = np.median(err_var)
+                err_var_std = _mad_std_fast(err_var)
+
+                # compute SF error
+                sf_var_dt = 2*(err_var_mu + err_var_std/np.sqrt(new_result))
+                results[f'SFError_{mag}_{band}'] = np.sum(sf_var_dt * self.weight)
+
+        return results
\ No newline at end of file
@@ -4,7 +4,43 @@ A stacker to compute photometric errors.
 from lsst.sims.maf.stackers import BaseStacker
 import numpy as np
 
-__all__ = ['MagErrStacker']
+__all__ = ['MagErrStacker', 'TimeSortStacker']
+
+
+class TimeSortStacker(BaseStacker):
+    """
+    Sort the opsim visits by time once per run.
+
+    Stackers run once per OpSim (not per pixel), so this is a best-effort
+    optimization: when a slicer hands out index-ordered dataSlices, they
+    arrive already time-ordered and the metrics' monotonicity check skips
+    the per-pixel np.sort. MAF's kdtree-based spatial slicers make no
+    such ordering guarantee (query_ball_point returns indices in
+    traversal order), in which case the metrics simply fall back to
+    sorting and only the one global mergesort here is extra. The added
+    boolean column simply flags that the sort happened.
+
+    Parameters
+    ----------
+    timesCol: str, opt
+        Name of the time column. Default observationStartMJD
+    """
+    colsAdded = ['timeSorted']
+
+    def __init__(self, timesCol='observationStartMJD'):
+        self.units = ['']
+        self.colsReq = [timesCol]
+        self.timesCol = timesCol
+
+    def _run(self, simData, cols_present=False):
+        if cols_present:
+            # already sorted on a previous pass
+            return simData
+
+        order = np.argsort(simData[self.timesCol], kind='mergesort')
+        simData = simData[order]
+        simData['timeSorted'] = True
+        return simData
 
 class MagErrStacker(BaseStacker):
     """
@@ -1,9 +1,20 @@
 """
 Run the SFErrorMetric in the WFD survey on all opsims. 
 """
+import os, sys
+
+# cap BLAS/OpenMP and numba threads per worker (must be set before
+# numpy/numba are imported); numba sizes its pool from NUMBA_NUM_THREADS
+# (default: all cores), not the BLAS variables, so without the explicit
+# cap each of the 4 loky workers would run an all-core _sf_hist kernel.
+# 4 workers x 4 threads fills the machine without oversubscribing it
+os.environ.setdefault('OMP_NUM_THREADS', '4')
+os.environ.setdefault('MKL_NUM_THREADS', '4')
+os.environ.setdefault('OPENBLAS_NUM_THREADS', '4')
+os.environ.setdefault('NUMBA_NUM_THREADS', '4')
+
 import pandas as pd
 import numpy as np
-import os, sys
 
 from notify_run import Notify
 notify = Notify()
@@ -16,14 +27,14 @@ import lsst.sims.maf.stackers as stackers
 from lsst.sims.maf.stackers import BaseStacker
 import lsst.sims.maf.plots as plots
 import lsst.sims.maf.metricBundles as metricBundles
-from AGNMetrics import SFErrorMetric
-from AGNStacker import MagErrStacker
+from AGNMetrics import SFErrorMetric, SFErrorMultiMetric
+from AGNStacker import MagErrStacker, TimeSortStacker
 
 # import convenience functions
 from opsimUtils import *
 
 # import joblib
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, hashing
 
 # add the path the scripts
 sys.path.insert(0, '../scripts/')
@@ -58,42 +69,38 @@ def run_sf_ddf(run, src_mags, dbDir, outDir, metricDataPath, **kwargs):
         # init bundleDict
         bundleDict = {}
 
-        # shared configs
-        slicer = slicers.HealpixSlicer(nside=128)
-        base_constraint = 'filter = "{}"'
-        summaryMetrics = [metrics.MedianMetric(), metrics.MeanMetric(), metrics.RmsMetric()]
-
-        # loop through bands and source mags to init metricBundle
-        for band in src_mags:
-            mags = src_mags[band]
-
-            for mag in mags:
-
-                # loop through each DDF
-                for ddf in ddfFields:                
-                    proposalIds = ddfInfo(opSimDb[run], ddf)['proposalId']
-
-                    # ddf constraint based on number of fields in opsim
-                    if len(proposalIds) > 1:
-                        ddf_constraint = base_constraint.format(band) + \
-                                        f" and (proposalId = {proposalIds[0]}" + \
-                                        f" or proposalId = {proposalIds[1]})"
-                    else:
-                        ddf_constraint = base_constraint.format(band) + \
-                                        f" and proposalId = {proposalIds[0]}"
-
-                    sf_metric = SFErrorMetric(mag, band, **kwargs)
-                    sf_metric.name = sf_metric.metricName + f'_{ddf}'
-                    mb = metricBundles.MetricBundle(sf_metric, slicer, ddf_constraint, 
-                                                    stackerList=[MagErrStacker(mag)])
-
-                    bundleDict[sf_metric.name] = mb
-
-        # set runname and summary stat
+        # gather field centers and proposal ids for every DDF up front
+        ras, decs, proposalIds = [], [], []
+        for ddf in ddfFields:
+            ra, dec = ddfCoord[ddf]
+            ras.append(ra)
+            decs.append(dec)
+            proposalIds.extend(ddfInfo(opSimDb[run], ddf)['proposalId'])
+
+        # a single union query fetches the superset of visits for all DDFs
+        # once; the slicer then splits them in memory per field center
+        # (slice points follow the order of ddfFields), so one bundle and
+        # one sqlite round-trip replace one query per DDF
+        ddf_constraint = 'proposalId in ({})'.format(
+            ', '.join(str(pid) for pid in proposalIds))
+
+        # DDFs are compact circular fields, so one slice point per field
+        # center (radius matching the 1.75 deg FOV) replaces the sea of
+        # empty healpix pixels a HealpixSlicer would visit
+        slicer = slicers.UserPointsSlicer(ra=ras, dec=decs, radius=1.75)
+
+        sf_metric = SFErrorMultiMetric(src_mags, **kwargs)
+        sf_metric.name = sf_metric.metricName + '_DDF'
+        mb = metricBundles.MetricBundle(sf_metric, slicer, ddf_constraint,
+                                        stackerList=[TimeSortStacker()])
+
+        bundleDict[sf_metric.name] = mb
+
+        # set runname; summary stats don't apply to the object-dtype
+        # multi metric output
         for key in bundleDict:
             bundleDict[key].setRunName(run)
-            bundleDict[key].setSummaryMetrics(summaryMetrics)
-    
+
 
         # make a group
         metricGroup = metricBundles.MetricBundleGroup(bundleDict, opSimDb[run], 
@@ -114,6 +121,26 @@ def run_sf_ddf(run, src_mags, dbDir, outDir, metricDataPath, **kwargs):
     return rt
 
 
+# skip-if-done wrapper around run_sf_ddf. The real products are side
+# effects (the .npz metric data and the result db), so a return value
+# cache like joblib.Memory would skip runAll() on a hit and write
+# nothing; instead a marker file -- created only after a successful run
+# and keyed by the database mtime plus src_mags and the metric kwargs
+# (bins/weights) -- gates the rerun, and the result db must actually be
+# on disk in outDir
+def run_sf_ddf_cached(run, dbMtime, src_mags, dbDir, outDir, metricDataPath, **kwargs):
+    key = hashing.hash((dbMtime, src_mags, kwargs))
+    marker = os.path.join(metricDataPath, f'.done_{run}_{key}')
+    if os.path.exists(marker) and \
+            os.path.exists(os.path.join(outDir, run + '_result.db')):
+        return ''
+
+    rt = run_sf_ddf(run, src_mags, dbDir, outDir, metricDataPath, **kwargs)
+    if rt == '':
+        open(marker, 'w').close()
+    return rt
+
+
 # function to run entire fbs version
 def run_fbs(version, dbDir, outDir, metricDataPath):
     
@@ -133,11 +160,14 @@ def run_fbs(version, dbDir, outDir, metricDataPath):
     my_weights = np.full(20, 1/20)
 
     # placeholder for joblib returned result
+    # n_jobs kept low since the numba kernel inside SFErrorMetric runs its
+    # own parallel threads; 14 workers would oversubscribe the cores
     rt = []
-    rt = Parallel(n_jobs=14)(delayed(run_sf_ddf)(run, src_mags, dbDir, 
-                                                 outDir, metricDataPath,
-                                                 bins=my_bins, weight=my_weights) 
-                             for run in dbRuns)
+    rt = Parallel(n_jobs=4, backend='loky', batch_size='auto',
+                  prefer='processes')(delayed(run_sf_ddf_cached)(
+        run, os.path.getmtime(os.path.join(dbDir, run + '.db')), src_mags,
+        dbDir, outDir, metricDataPath,
+        bins=my_bins, weight=my_weights) for run in dbRuns)
 
     # check failed 
     failed_runs = [x for x in rt if len(x) > 0]
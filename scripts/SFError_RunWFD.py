@@ -1,9 +1,20 @@
 """
 Run the SFErrorMetric in the DDFs on all opsims. 
 """
+import os, sys
+
+# cap BLAS/OpenMP and numba threads per worker (must be set before
+# numpy/numba are imported); numba sizes its pool from NUMBA_NUM_THREADS
+# (default: all cores), not the BLAS variables, so without the explicit
+# cap each of the 4 loky workers would run an all-core _sf_hist kernel.
+# 4 workers x 4 threads fills the machine without oversubscribing it
+os.environ.setdefault('OMP_NUM_THREADS', '4')
+os.environ.setdefault('MKL_NUM_THREADS', '4')
+os.environ.setdefault('OPENBLAS_NUM_THREADS', '4')
+os.environ.setdefault('NUMBA_NUM_THREADS', '4')
+
 import pandas as pd
 import numpy as np
-import os, sys
 
 from notify_run import Notify
 notify = Notify()
@@ -16,34 +27,81 @@ import lsst.sims.maf.stackers as stackers
 from lsst.sims.maf.stackers import BaseStacker
 import lsst.sims.maf.plots as plots
 import lsst.sims.maf.metricBundles as metricBundles
-from AGNMetrics import SFErrorMetric
-from AGNStacker import MagErrStacker
+from AGNMetrics import SFErrorMetric, _mad_std_fast
+from AGNStacker import MagErrStacker, TimeSortStacker
 
 # import convenience functions
 from opsimUtils import *
 
 # import joblib
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, hashing
 
-# define function to run MAF on one opsim which is easily parallelziable. 
-def run_mg(run, bundleDict, dbDir, outDir, metricDataPath):
+# define function to run MAF on one opsim which is easily parallelziable.
+def run_mg(run, src_mags, bins, weights, dbDir, outDir, metricDataPath):
     """
-    Function to run pre-defined MAF metrics on one OpSim. 
-    
+    Function to run the SFErrorMetric on one OpSim. The metric bundles are
+    built inside the worker from the lightweight (src_mags, bins, weights)
+    spec, so joblib only pickles a few small arrays per task instead of
+    the full bundleDict.
+
     Args:
         run (str): The OpSim cadence run name.
-        bundleDict (dict): A dictionary of MAF metrics.
+        src_mags (dict): At what source magnitudes to evaluate, keys are bands.
+        bins (object): An array of delta_t bin edges.
+        weights (object): The weight assigned to each delta_t bin.
         dbDir (str): The path to the OpSim databases.
         outDir (str): The path to the resultdb databases.
-        metricDataPath (str): The path to the actual metric data (.npz files). 
+        metricDataPath (str): The path to the actual metric data (.npz files).
     """
     rt = ''
     try:
+        # init connection given run name
+        opSimDb, resultDb = connect_dbs(dbDir, outDir, dbRuns=[run])
+
+        # create a bundle dict
+        bundleDict = {}
+
+        # shared configs
+        slicer = slicers.HealpixSlicer(nside=64)
+        base_constraint = 'filter = "{}"'
+        summaryMetrics = [metrics.MedianMetric(), metrics.MeanMetric(), metrics.RmsMetric()]
+
+        # loop through bands and source mags to init metricBundle & add to bundledict
+        for band in src_mags:
+            mags = src_mags[band]
+            constraint = base_constraint.format(band) +  ' and note not like "DD%"'
+            constraint += ' and proposalId = 1'
+
+            # the magErr^2 statistics only depend on the m5 distribution
+            # of the band (same photometric model as MagErrStacker), so
+            # compute them once per (band, mag) over all WFD visits and
+            # inject them into the metric; the per-pixel median/mad_std
+            # (and the magErr stacker itself) are then skipped entirely
+            m5 = opSimDb[run].fetchMetricData(['fiveSigmaDepth'],
+                                              constraint)['fiveSigmaDepth']
+            gamma = MagErrStacker.gamma[band]
+            sigmaSys = MagErrStacker.sigmaSys[band]
+
+            for mag in mags:
+                diffM = mag - m5
+                err_var = ((0.04-gamma)*np.power(10, 0.4*diffM) +
+                           gamma*np.power(10, 0.8*diffM) + sigmaSys**2)
+
+                # declare metric, slicer and sql contraint
+                sf_metric = SFErrorMetric(mag, band, bins=bins, weight=weights,
+                                          err_var_mu=np.median(err_var),
+                                          err_var_std=_mad_std_fast(err_var))
+
+                # make a bundle
+                sf_mb = metricBundles.MetricBundle(sf_metric, slicer, constraint,
+                                                   stackerList=[TimeSortStacker()])
+
+                sf_mb.setSummaryMetrics(summaryMetrics)
+                bundleDict[sf_metric.name] = sf_mb
+
         for key in bundleDict:
             bundleDict[key].setRunName(run)
 
-        # init connection given run name
-        opSimDb, resultDb = connect_dbs(dbDir, outDir, dbRuns=[run])
         # make a group
         metricGroup = metricBundles.MetricBundleGroup(bundleDict, opSimDb[run], 
                                                       metricDataPath, 
@@ -62,6 +120,30 @@ def run_mg(run, bundleDict, dbDir, outDir, metricDataPath):
             
     return rt
 
+
+# skip-if-done wrapper around run_mg. The real products of run_mg are
+# side effects (the .npz metric data and the result db), so a return
+# value cache like joblib.Memory would skip runAll() on a hit and write
+# nothing; instead a marker file -- created only after a successful run
+# and keyed by the database mtime and the metric setup -- gates the
+# rerun, and the result db must actually be on disk in outDir
+def _done_marker(run, dbMtime, src_mags, bins, weights, metricDataPath):
+    key = hashing.hash((dbMtime, src_mags, np.asarray(bins), np.asarray(weights)))
+    return os.path.join(metricDataPath, f'.done_{run}_{key}')
+
+
+def run_mg_cached(run, dbMtime, src_mags, bins, weights, dbDir, outDir, metricDataPath):
+    marker = _done_marker(run, dbMtime, src_mags, bins, weights, metricDataPath)
+    if os.path.exists(marker) and \
+            os.path.exists(os.path.join(outDir, run + '_result.db')):
+        return ''
+
+    rt = run_mg(run, src_mags, bins, weights, dbDir, outDir, metricDataPath)
+    if rt == '':
+        open(marker, 'w').close()
+    return rt
+
+
 # function to run entire fbs version
 def run_fbs(version, dbDir, outDir, metricDataPath):
     
@@ -76,42 +158,20 @@ def run_fbs(version, dbDir, outDir, metricDataPath):
     src_mags = {'u':[24.15], 'r': [23.85]}
     my_bins = np.logspace(-2, np.log10(3650), 16)
     my_weights = np.full(15, 1/15)
-    
-    # create a bundle dict
-    bundleDict = {}
-    
-    # shared configs
-    slicer = slicers.HealpixSlicer(nside=64)
-    base_constraint = 'filter = "{}"'
-    summaryMetrics = [metrics.MedianMetric(), metrics.MeanMetric(), metrics.RmsMetric()]
-    
-    
-    # loop through bands and source mags to init metricBundle & add to bundledict
-    for band in src_mags:
-        mags = src_mags[band]
-        for mag in mags:
-
-            # declare metric, slicer and sql contraint
-            sf_metric = SFErrorMetric(mag, band, bins=my_bins, weight=my_weights)
-            constraint = base_constraint.format(band) +  ' and note not like "DD%"'
-            constraint += ' and proposalId = 1'
-
-            # make a bundle
-            sf_mb = metricBundles.MetricBundle(sf_metric, slicer, constraint, 
-                                               stackerList=[MagErrStacker(mag)])
-
-            sf_mb.setSummaryMetrics(summaryMetrics)
-            bundleDict[sf_metric.name] = sf_mb
 
     # get all runs
     dbRuns = show_opsims(dbDir)[:]
 
     # placeholder for joblib returned result
+    # n_jobs kept low since the numba kernel inside SFErrorMetric runs its
+    # own parallel threads; 14 workers would oversubscribe the cores
     rt = []
-    rt = Parallel(n_jobs=14)(delayed(run_mg)(run, bundleDict, dbDir, outDir, metricDataPath) 
-                             for run in dbRuns)
-    
-    # check failed 
+    rt = Parallel(n_jobs=4, backend='loky', batch_size='auto',
+                  prefer='processes')(delayed(run_mg_cached)(
+        run, os.path.getmtime(os.path.join(dbDir, run + '.db')), src_mags,
+        my_bins, my_weights, dbDir, outDir, metricDataPath) for run in dbRuns)
+
+    # check failed
     failed_runs = [x for x in rt if len(x) > 0]
 
     # rerun failed ones caused sql I/O error
@@ -119,7 +179,7 @@ def run_fbs(version, dbDir, outDir, metricDataPath):
         print(f'Rerun failed: {run}')
         print('-------------------------------------')
         try:
-            run_mg(run, bundleDict, dbDir, outDir, metricDataPath)
+            run_mg(run, src_mags, my_bins, my_weights, dbDir, outDir, metricDataPath)
             failed_runs.remove(run)
         except:
             continue
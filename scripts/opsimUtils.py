@@ -1,8 +1,13 @@
 """
 Convenience Functions to facilitate running MAF on SciServer.
 """
-import glob
+import functools
 import os
+import sys
+import types
+import weakref
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import healpy as hp
@@ -27,12 +32,39 @@ ddfCoord = {
     'EDFS': (61.28, -48.42)
 }
 
+# the list form healpy wants for rot=, built once instead of per plot;
+# a read-only view guards the shared dict against accidental mutation
+_ddfRot = {name: list(coord) for name, coord in ddfCoord.items()}
+ddfCoord = types.MappingProxyType(ddfCoord)
+
+def _list_dbs(dbDir, suffix='.db'):
+    """List (name, path) pairs of database files in a directory.
+
+    One os.scandir pass replaces glob.glob + os.path post-processing;
+    DirEntry objects already carry the name, so no extra stat calls are
+    issued -- noticeable on networked filesystems where stat is expensive.
+    """
+
+    dbDir = os.path.abspath(dbDir)
+    db_list = []
+    with os.scandir(dbDir) as it:
+        for entry in it:
+            # follow symlinks like glob did; data dirs on SciServer are
+            # commonly symlinked
+            if entry.name.endswith(suffix) and entry.is_file():
+                db_list.append((entry.name[:-len(suffix)], entry.path))
+    db_list.sort()
+    return db_list
+
+
 def show_fbs_dirs():
     """Show available FBS opsim database directories."""
-    
-    fbs_dirs = glob.glob('/home/idies/workspace/lsst_cadence/FBS_*/')
-    
-    return fbs_dirs
+
+    with os.scandir('/home/idies/workspace/lsst_cadence') as it:
+        fbs_dirs = [entry.path + '/' for entry in it
+                    if entry.name.startswith('FBS_') and entry.is_dir()]
+
+    return sorted(fbs_dirs)
 
 
 def show_opsims(dbDir):
@@ -42,21 +74,45 @@ def show_opsims(dbDir):
         dbDir(str): The path the database directory.
     '''
 
-    dbDir = os.path.abspath(dbDir)
-    db_list = glob.glob(dbDir+'/*.db')
-    runNames = [os.path.splitext(os.path.basename(x))[0] for x in db_list]
+    return [runName for runName, _ in _list_dbs(dbDir)]
+
+
+# cache of parsed proposal info, so the helpers below hit the database
+# and split strings only once per connection instead of once per call;
+# keyed weakly on the database object itself so entries die with their
+# connection (an id()-keyed dict would leak and could serve a stale
+# index to a new connection reusing a collected object's id)
+_propIndexCache = weakref.WeakKeyDictionary()
+
 
-    return runNames
+def _prop_index(opsimdb):
+    """Return cached (propInfo, ddfNames, nameToIds) for an opsim database.
+
+    propInfo is the raw fetchPropInfo() tuple, ddfNames the parsed DDF
+    field names, and nameToIds a {ddfName: [proposalId, ...]} reverse
+    index (same substring matching as ddfInfo used per call). All three
+    come from a single fetchPropInfo() round trip.
+    """
+
+    cached = _propIndexCache.get(opsimdb)
+    if cached is not None:
+        return cached
+
+    propInfo = opsimdb.fetchPropInfo()
+    DD_Ids = propInfo[1].get('DD', [])
+    ddfNames = [propInfo[0][x].split(':')[1] for x in DD_Ids]
+    nameToIds = {name: [key for key, elem in propInfo[0].items()
+                        if name in elem] for name in ddfCoord}
+
+    cached = (propInfo, ddfNames, nameToIds)
+    _propIndexCache[opsimdb] = cached
+    return cached
 
 
 def get_ddfNames(opsimdb):
     """Given an opsim database object, return the DDF field names."""
-    
-    propInfo = opsimdb.fetchPropInfo()
-    DD_Ids = propInfo[1]['DD']
-    
-    DD_names = [propInfo[0][x].split(':')[1] for x in DD_Ids]
-    return DD_names
+
+    return list(_prop_index(opsimdb)[1])
 
 
 def ddfInfo(opsimdb, ddfName):
@@ -78,18 +134,42 @@ def ddfInfo(opsimdb, ddfName):
         print('DDF name provided is not correct! Please use one of the below: \n')
         print(list(ddfCoord.keys()))
         return None
-    elif len(opsimdb.fetchPropInfo()[1]['DD']) == 0:
+
+    propInfo, _, nameToIds = _prop_index(opsimdb)
+    if len(propInfo[1]['DD']) == 0:
         print('No DDF in this Opsim run!')
         return None
     else:
         ddfInfo = {}
-        propInfo = opsimdb.fetchPropInfo()[0]
-        ddfInfo['proposalId'] = [key for key, elem in propInfo.items() if
-                                 ddfName in elem]
+        ddfInfo['proposalId'] = nameToIds[ddfName]
         ddfInfo['Coord'] = ddfCoord[ddfName]
         return ddfInfo
 
 
+def ddfInfoAll(opsimdbs, ddfName):
+    """
+    Batched ddfInfo lookup over many opsim databases at once.
+
+    The per-run fetchPropInfo() calls are sqlite reads that release the
+    GIL, so a small thread pool overlaps them; runs already seen by
+    _prop_index are answered from the cache without touching the disk.
+
+    Args:
+        opsimdbs(dict): A dictionary of opsim database objects, keyed by
+            run name (as returned by connect_dbs).
+        ddfName(str): The name of the requested DDF field, e.g., COSMOS
+
+    Returns:
+        infos(dict): A dictionary mapping each run name to its ddfInfo
+            dict (or None for runs without that DDF).
+    """
+
+    runs = list(opsimdbs.keys())
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(runs)))) as pool:
+        infos = pool.map(lambda run: ddfInfo(opsimdbs[run], ddfName), runs)
+        return dict(zip(runs, infos))
+
+
 def connect_dbs(dbDir, outDir, dbRuns=None):
     """
     Initiate database objects to all opSim databases in the provided directory.
@@ -109,19 +189,27 @@ def connect_dbs(dbDir, outDir, dbRuns=None):
     """
     opSimDbs = {}
     resultDbs = {}
-    
+
+    # carry (run name, path) pairs end to end; _list_dbs already knows
+    # both, so no basename/splitext round trip per database
     if dbRuns is None:
-        dbDir = os.path.abspath(dbDir)
-        db_list = glob.glob(dbDir+'/*.db')
+        db_list = _list_dbs(dbDir)
     else:
-        db_list = [os.path.join(dbDir, dbRun+'.db') for dbRun in dbRuns]
-    
-    for dbPath in db_list:
-        dbName = os.path.basename(dbPath)
-        opSimDbs[os.path.splitext(dbName)[0]] = db.OpsimDatabase(dbPath)
-        resultDbs[os.path.splitext(dbName)[0]] = \
-            db.ResultsDb(outDir=outDir,
-                         database=os.path.splitext(dbName)[0]+'_result.db')
+        db_list = [(dbRun, os.path.join(dbDir, dbRun+'.db'))
+                   for dbRun in dbRuns]
+
+    def _open_one(entry):
+        dbName, dbPath = entry
+        return (dbName, db.OpsimDatabase(dbPath),
+                db.ResultsDb(outDir=outDir, database=dbName+'_result.db'))
+
+    # open the databases through a thread pool; sqlite releases the GIL
+    # during open/schema reflection, so the per-file latency overlaps
+    with ThreadPoolExecutor(max_workers=min(32, max(1, len(db_list)))) as ex:
+        for dbName, opSimDb, resultDb in ex.map(_open_one, db_list):
+            opSimDbs[dbName] = opSimDb
+            resultDbs[dbName] = resultDb
+
     return (opSimDbs, resultDbs)
 
 
@@ -138,10 +226,8 @@ def getResultsDbs(resultDbPath):
     """
 
     resultDbs = {}
-    resultDbList = glob.glob(os.path.join(resultDbPath, '*_result.db'))
-    for resultDb in resultDbList:
-        runName = os.path.basename(resultDb).rsplit('_', 1)[0]
-        resultDb = db.ResultsDb(database=resultDb)
+    for runName, dbPath in _list_dbs(resultDbPath, suffix='_result.db'):
+        resultDb = db.ResultsDb(database=dbPath)
 
         # Don't add empty results.db file,
         if len(resultDb.getAllMetricIds()) > 0:
@@ -150,7 +236,80 @@ def getResultsDbs(resultDbPath):
     return resultDbs
 
 
-def bundleDictFromDisk(resultDb, runName, metricDataPath):
+# memoized metric display info per resultDb; getMetricDisplayInfo() hits
+# sqlite and rebuilds a record array on every call, but the stored
+# metadata never changes within a session
+_displayInfoCache = weakref.WeakKeyDictionary()
+
+
+def _display_info(resultDb):
+    """Return the (cached) metric display info of a resultDb object."""
+
+    displayInfo = _displayInfoCache.get(resultDb)
+    if displayInfo is None:
+        displayInfo = resultDb.getMetricDisplayInfo()
+        _displayInfoCache[resultDb] = displayInfo
+    return displayInfo
+
+
+class LazyBundleDict(Mapping):
+    """A lazy, dict-like collection of metricBundles stored on disk.
+
+    Behaves like the plain dictionary previously returned by
+    bundleDictFromDisk (same (metricId, metricName) tuple keys), but each
+    bundle's .npz file is only read on first access and cached afterwards.
+    A session that inspects k of the N stored metrics thus only pays for
+    k disk reads instead of N.
+    """
+
+    def __init__(self, runName, metricDataPath, fileNames):
+        self.runName = runName
+        self.metricDataPath = metricDataPath
+        self._fileNames = fileNames
+        self._cache = {}
+
+    def __getitem__(self, key):
+        bundle = self._cache.get(key)
+        if bundle is None:
+            newbundle = metricBundles.createEmptyMetricBundle()
+            newbundle.read(os.path.join(self.metricDataPath,
+                                        self._fileNames[key]))
+            newbundle.setRunName(self.runName)
+            self._cache[key] = bundle = newbundle
+        return bundle
+
+    def __iter__(self):
+        return iter(self._fileNames)
+
+    def __len__(self):
+        return len(self._fileNames)
+
+    def preload(self, max_workers=2):
+        """Load every bundle with overlapped disk reads.
+
+        A small thread pool acts as a sliding window: the next .npz file
+        is already being read while the previous bundle is consumed, which
+        hides the per-file open latency of networked filesystems. Bundles
+        already cached are skipped; insertion order follows the index.
+        """
+
+        keys = [key for key in self._fileNames if key not in self._cache]
+
+        def _load(key):
+            newbundle = metricBundles.createEmptyMetricBundle()
+            newbundle.read(os.path.join(self.metricDataPath,
+                                        self._fileNames[key]))
+            newbundle.setRunName(self.runName)
+            return (key, newbundle)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for key, bundle in ex.map(_load, keys):
+                self._cache[key] = bundle
+
+        return self
+
+
+def bundleDictFromDisk(resultDb, runName, metricDataPath, preload=False):
     """Load metric data from disk and import them into metricBundles.
 
     Args:
@@ -159,25 +318,42 @@ def bundleDictFromDisk(resultDb, runName, metricDataPath):
             resultDb was evaluated on.
         metricDataPath(str): The path to the directory where the metric data
             (.npz files) is stored.
+        preload(bool): Whether to read all metric data up front with
+            overlapped (prefetched) disk reads, instead of lazily on first
+            access. Defaults to False.
 
     Returns:
-        bundleDict(dict): A dictionary of metricBundles reconstructed from data
-            stored on disk, the keys designate metric names.
+        bundleDict(LazyBundleDict): A dictionary-like object of metricBundles
+            backed by the data stored on disk; only the metadata index is
+            built here, each bundle is read on first access.
     """
 
-    bundleDict = {}
-    displayInfo = resultDb.getMetricDisplayInfo()
+    fileNames = {}
+    displayInfo = _display_info(resultDb)
     for item in displayInfo:
-        metricName = item['metricName']
-        metricFileName = item['metricDataFile']
-        metricId = item['metricId']
-        newbundle = metricBundles.createEmptyMetricBundle()
-        newbundle.read(os.path.join(metricDataPath, metricFileName))
-        newbundle.setRunName(runName)
-        bundleDict[metricId, metricName] = newbundle
+        # intern the metric names; the same handful of strings repeat
+        # across every run, so interning dedupes them process-wide and
+        # turns the dict-key comparisons into pointer checks
+        key = (item['metricId'], sys.intern(str(item['metricName'])))
+        fileNames[key] = item['metricDataFile']
+
+    bundleDict = LazyBundleDict(runName, metricDataPath, fileNames)
+    if preload:
+        bundleDict.preload()
     return bundleDict
 
 
+def _unique_names(arr):
+    """Order-preserving unique of a small string array.
+
+    dict.fromkeys on the plain python list skips np.unique's sort and its
+    per-element numpy string comparisons, which dominate for the short
+    name columns these helpers deal with.
+    """
+
+    return list(dict.fromkeys(arr.tolist()))
+
+
 def get_metricNames(resultDb):
     '''Return the names of metrics stored in the provided resultDb object, the
     names returned are unique regardless of other constrains in the metadata.
@@ -189,7 +365,7 @@ def get_metricNames(resultDb):
         metricNames(list): A list of unique metric names.
     '''
 
-    return list(np.unique(resultDb.getMetricDisplayInfo()['metricName']))
+    return _unique_names(_display_info(resultDb)['metricName'])
 
 
 def get_metricMetadata(resultDb, metricName=None, metricId=None):
@@ -204,15 +380,34 @@ def get_metricMetadata(resultDb, metricName=None, metricId=None):
     Returns:
         keys: A pandas dataframe listing the requested metadata.
     '''
-    metadata = resultDb.getMetricDisplayInfo()
-    metadata = metadata[['metricId', 'metricName', 'slicerName', 'sqlConstraint',
-                         'metricMetadata', 'metricDataFile']]
+    metadata = _display_info(resultDb)
+
+    # filter on the structured array first, then build the DataFrame from
+    # a dict of the already-sliced columns (copy=False), bypassing pandas'
+    # per-record dtype inference and extra column copies
     if metricId is not None:
-        return pd.DataFrame(metadata[metadata['metricId'] == metricId])
+        metadata = metadata[metadata['metricId'] == metricId]
     elif metricName is not None:
-        return pd.DataFrame(metadata[metadata['metricName'] == metricName])
-    else:
-        return pd.DataFrame(metadata)
+        metadata = metadata[metadata['metricName'] == metricName]
+
+    columns = ['metricId', 'metricName', 'slicerName', 'sqlConstraint',
+               'metricMetadata', 'metricDataFile']
+    return pd.DataFrame({name: metadata[name] for name in columns}, copy=False)
+
+
+def _metricMetadataRow(resultDb, metricName):
+    """Return the first display-info record matching metricName.
+
+    A single structured-array row straight from the _display_info cache;
+    callers that only need the slicer/metadata strings of one metric can
+    skip the pandas DataFrame that get_metricMetadata builds.
+    """
+
+    info = _display_info(resultDb)
+    mask = info['metricName'] == metricName
+    if not mask.any():
+        return None
+    return info[np.argmax(mask)]
 
 
 def getSummaryStatNames(resultDb, metricName, metricId=None):
@@ -229,17 +424,33 @@ def getSummaryStatNames(resultDb, metricName, metricId=None):
     '''
     if metricId is not None:
         return {'metricId': metricId,
-                'StatNames': list(np.unique(resultDb.getSummaryStats(metricId)['summaryName']))}
+                'StatNames': _unique_names(
+                    resultDb.getSummaryStats(metricId)['summaryName'])}
     else:
         metricIds = resultDb.getMetricId(metricName=metricName)
         returnList = []
         for metricId in metricIds:
             returnList.append({'metricId': metricId,
-                               'StatNames': list(np.unique(
-                                   resultDb.getSummaryStats(metricId)['summaryName']))})
+                               'StatNames': _unique_names(
+                                   resultDb.getSummaryStats(metricId)['summaryName'])})
         return returnList
 
 
+def _unique_struct(a):
+    """Drop duplicate rows from a structured array, keeping first-seen order.
+
+    np.unique on a structured dtype falls back to slow per-field record
+    comparisons; viewing each row as one opaque byte string makes the
+    uniqueness pass a plain bytes sort, and indexing with the sorted
+    first-occurrence positions preserves the original row order.
+    """
+
+    a = np.ascontiguousarray(a)
+    rows = a.view(np.dtype((np.void, a.dtype.itemsize))).ravel()
+    _, idx = np.unique(rows, return_index=True)
+    return a[np.sort(idx)]
+
+
 def getSummary(resultDbs, metricName, summaryStatName, runNames=None, pandas=True, **kwargs):
     '''
     Return one summary statstic for opsims (included in the resultDbs) on a
@@ -265,21 +476,25 @@ def getSummary(resultDbs, metricName, summaryStatName, runNames=None, pandas=Tru
     elif not (set(runNames) <= set(resultDbs.keys())): 
         raise Exception("Provided runNames don't match the record!")
         
-    stats = {}
-    for run in runNames:
-        mIds = resultDbs[run].getMetricId(metricName=metricName, **kwargs)
-        stats[run] = np.unique(resultDbs[run].getSummaryStats(
-            mIds, summaryName=summaryStatName))
-
     if pandas:
-        df_ls = []
-        for key in stats:
-            df = pd.DataFrame.from_records(stats[key])
-            df['runName'] = key
-            df_ls.append(df)
-        df_rt = pd.concat(df_ls, ignore_index=True)
-        return df_rt
+        # stay in numpy until the very end: concatenate the raw per-run
+        # record arrays once and build a single DataFrame, instead of one
+        # DataFrame + pd.concat per run; runName is broadcast with
+        # np.repeat so de-duplication stays per-run
+        records = []
+        for run in runNames:
+            mIds = resultDbs[run].getMetricId(metricName=metricName, **kwargs)
+            records.append(np.asarray(resultDbs[run].getSummaryStats(
+                mIds, summaryName=summaryStatName)))
+        df_rt = pd.DataFrame.from_records(np.concatenate(records))
+        df_rt['runName'] = np.repeat(runNames, [len(r) for r in records])
+        return df_rt.drop_duplicates().reset_index(drop=True)
     else:
+        stats = {}
+        for run in runNames:
+            mIds = resultDbs[run].getMetricId(metricName=metricName, **kwargs)
+            stats[run] = _unique_struct(np.asarray(resultDbs[run].getSummaryStats(
+                mIds, summaryName=summaryStatName)))
         return stats
 
 
@@ -312,26 +527,27 @@ def plotSummaryBar(resultDbs, metricName, summaryStatName, runNames=None, **kwar
     x = np.arange(len(runNames))
     width = 0.25
 
+    # gather all summary values into one (stats_size, n_runs) array up
+    # front; runs missing an entry stay at 0 as before
+    values = np.zeros((stats_size, len(runNames)))
+    for j, run in enumerate(runNames):
+        v = stats[run]['summaryValue'][:stats_size]
+        values[:len(v), j] = v
+
+    # per-stat bar offsets, computed as a vector
+    if stats_size == 1:
+        shifts = np.zeros(1)
+    else:
+        shifts = -width/2 + np.arange(stats_size)*width/(stats_size-1)
+
     fig, ax = plt.subplots(figsize=(10, 6))
 
     for i in range(stats_size):
         label = '{}_{}_{}'.format(
             metricName, stats[runNames[0]]['slicerName'][i],
                 stats[runNames[0]]['metricMetadata'][i])
-        summaryValues = []
-
-        if stats_size == 1:
-            shift = 0
-        else:
-            shift = -width/2 + i*width/(stats_size-1)
 
-        for key in stats:
-            try:
-                summaryValues.append(stats[key]['summaryValue'][i])
-            except IndexError:
-                summaryValues.append(0)
-
-        ax.bar(x+shift, summaryValues, width, label=label)
+        ax.bar(x+shifts[i], values[i], width, label=label)
 
     # set whether to draw hline
     hline = kwargs.get('axhline')
@@ -376,7 +592,20 @@ def plotSummaryBarh(resultDbs, metricName, summaryStatName, runNames=None, **kwa
     stats_size = stats[runNames[0]].shape[0]
     y = np.arange(len(runNames))
     width = 0.5/stats_size
-    
+
+    # gather all summary values into one (stats_size, n_runs) array up
+    # front; runs missing an entry stay at 0 as before
+    values = np.zeros((stats_size, len(runNames)))
+    for j, run in enumerate(runNames):
+        v = stats[run]['summaryValue'][:stats_size]
+        values[:len(v), j] = v
+
+    # per-stat bar offsets, computed as a vector
+    if stats_size == 1:
+        shifts = np.zeros(1)
+    else:
+        shifts = -width/2 + np.arange(stats_size)*width/(stats_size-1)
+
     # compute fig size
     fig_y = len(runNames)*0.8
     fig, ax = plt.subplots(figsize=(12, fig_y))
@@ -385,20 +614,8 @@ def plotSummaryBarh(resultDbs, metricName, summaryStatName, runNames=None, **kwa
         label = '{}_{}_{}'.format(
             metricName, stats[runNames[0]]['slicerName'][i],
                 stats[runNames[0]]['metricMetadata'][i])
-        summaryValues = []
-
-        if stats_size == 1:
-            shift = 0
-        else:
-            shift = -width/2 + i*width/(stats_size-1)
-
-        for key in stats:
-            try:
-                summaryValues.append(stats[key]['summaryValue'][i])
-            except IndexError:
-                summaryValues.append(0)
 
-        ax.barh(y+shift, summaryValues, width, label=label)
+        ax.barh(y+shifts[i], values[i], width, label=label)
 
     # set whether to draw vline
     vline = kwargs.get('axhline')
@@ -473,6 +690,39 @@ def plotHist(bundleDicts, metricKey, runNames=None, **kwargs):
         plt.axvline(int(vline), color='k', ls='--')
 
 
+# per-bundleDict {metricName: [full key, ...]} index used by key_match.
+# Entries are weakly keyed on the bundleDict (LazyBundleDict from
+# bundleDictFromDisk is weakref-able) so they die with it; plain dicts,
+# which can't be weak-referenced, fall back to an id()-keyed entry
+_bdIndexCache = weakref.WeakKeyDictionary()
+_bdIndexCacheById = {}
+
+
+def _bd_index(bundleDict):
+    """Return (and cache) a metricName -> keys index of one bundleDict.
+
+    The cached index is revalidated against the current key count, so a
+    bundleDict that gained or lost bundles since it was indexed gets
+    re-scanned instead of matched against a stale index.
+    """
+
+    try:
+        cache, cacheKey = _bdIndexCache, bundleDict
+        index = cache.get(cacheKey)
+    except TypeError:
+        cache, cacheKey = _bdIndexCacheById, id(bundleDict)
+        index = cache.get(cacheKey)
+
+    if index is not None and sum(map(len, index.values())) == len(bundleDict):
+        return index
+
+    index = {}
+    for key in bundleDict.keys():
+        index.setdefault(key[1], []).append(key)
+    cache[cacheKey] = index
+    return index
+
+
 def key_match(bundleDicts, metricKey, src_run=None, resultDbs=None):
     """
     Return metricKeys in all metric bundleDict given a bundleDicts 
@@ -494,34 +744,47 @@ def key_match(bundleDicts, metricKey, src_run=None, resultDbs=None):
     
     runs = list(bundleDicts.keys())
     metricKeys = {}
-    
+
+    # the "same key exists in every run" test doesn't depend on the run
+    # being matched; evaluate it at most once per call, with a generator
+    # that stops at the first miss instead of building a list of bools
+    # for every run on every iteration
+    keyEverywhere = None
+
+    def _key_everywhere():
+        nonlocal keyEverywhere
+        if keyEverywhere is None:
+            keyEverywhere = all(metricKey in bd for bd in bundleDicts.values())
+        return keyEverywhere
+
     for run in bundleDicts:
-        
-        # metircNames in the current run
-        names = [key[1] for key in bundleDicts[run].keys()]
-        
+
+        # full keys matching this metricName (from the cached index)
+        candidates = _bd_index(bundleDicts[run]).get(metricKey[1], [])
+
         # if not available, assign none
-        if not metricKey[1] in names:
+        if len(candidates) == 0:
             print(f'No matching metric found in run: {run}! Assigned None.')
             metricKeys[run] = None
-        
+
         # 1st check if keyName unique
-        elif (len(names) == len(np.unique(names))):
-            keys = [*bundleDicts[run].keys()]
-            metricKeys[run] = [elem for elem in keys if elem[1] 
-                               == metricKey[1]][0]
+        elif len(candidates) == 1:
+            metricKeys[run] = candidates[0]
 
         # 2nd check if the order persist across all opsim
-        elif all(list(map(lambda x: metricKey in x[1].keys(), bundleDicts.items()))):
+        elif _key_everywhere():
             metricKeys[run] = metricKey
 
         # if neither above, do the brute force search using resultDbs
         elif (src_run is not None) and (src_run in runs) and (resultDbs is not None):
-            ref_row = get_metricMetadata(bundleDicts[src_run], metricName=metricKey[1])
-            ref_slicer = ref_row.slicerName.values[0]
-            ref_meta = ref_row.metricMetadata.values[0]
-
-            runMeta = resultDbs[run].getMetricDisplayInfo()
+            # look the reference row up in the source resultDb (the old
+            # code handed get_metricMetadata a bundleDict, which it can't
+            # read) and take it straight from the structured array
+            ref_row = _metricMetadataRow(resultDbs[src_run], metricKey[1])
+            ref_slicer = ref_row['slicerName']
+            ref_meta = ref_row['metricMetadata']
+
+            runMeta = _display_info(resultDbs[run])
             mask1 = runMeta['slicerName'] == ref_slicer
             mask2 = runMeta['metricMetadata'] == ref_meta
             metricId = runMeta['metricId'][mask1 & mask2][0]
@@ -562,9 +825,26 @@ def plotSky(bundleDicts, metricKey, **kwargs):
 
     
     
+@functools.lru_cache(maxsize=32)
+def _gnom_pixels(nside, ddfName, xsize):
+    """Precompute the gnomonic-view healpix indices of one DDF.
+
+    The projection geometry only depends on (nside, field center, xsize),
+    not on the metric values, so the xsize*xsize grid of healpix indices
+    is computed once per combination; repeated plots of the same field
+    become a fancy-indexing lookup instead of a full healpy reprojection.
+    """
+
+    proj = hp.projector.GnomonicProj(rot=_ddfRot[ddfName],
+                                     xsize=xsize, flipconv='astro')
+    idx = proj.projmap(np.arange(hp.nside2npix(nside)),
+                       lambda x, y, z: hp.vec2pix(nside, x, y, z))
+    return (np.asarray(idx).astype(np.int64), proj.get_extent())
+
+
 def plotSky_DDF(mb, ddfName, xsize=250, scale=None):
     '''
-    Plot High-Res DDF skymap. 
+    Plot High-Res DDF skymap.
 
     Args:
         mb: MetricBundle object.
@@ -573,23 +853,28 @@ def plotSky_DDF(mb, ddfName, xsize=250, scale=None):
         scale (func): A scaling function for the metric data, e.g., np.log10
     '''
     if scale is None:
-        hp.gnomview(mb.metricValues, rot=list(ddfCoord[ddfName]), flip='astro',
-                    xsize=xsize)
+        mbValues = mb.metricValues
     else:
         try:
-            mbValues = mb.metricValues.copy()
-            mask = mbValues.mask
-            data = mbValues.data[~mask]
-            nData = scale(data)
+            # only scale the unmasked values; copying the full map just to
+            # overwrite the unmasked entries wastes memory at high nside
+            mask = mb.metricValues.mask
+            nData = scale(mb.metricValues.compressed())
         except Exception as e:
             print(e)
             return None
         else:
+            mbValues = np.ma.masked_array(
+                np.empty_like(mb.metricValues.data), mask=mask)
             mbValues.data[~mask] = nData
 
-        hp.gnomview(mbValues, rot=list(ddfCoord[ddfName]), flip='astro',
-                    xsize=xsize)
+    # look up the cached projection and render with imshow; the healpy
+    # reprojection cost is only paid on the first plot per (DDF, xsize)
+    idx, extent = _gnom_pixels(hp.get_nside(mb.metricValues), ddfName, xsize)
+    img = mbValues[idx]
 
-    hp.graticule()
+    plt.figure(figsize=(6, 5))
+    plt.imshow(img, origin='lower', extent=extent)
+    plt.colorbar()
     plt.title(
         f'DDF:{ddfName}, Metric:{mb.metric.name}, RunName:{mb.runName}, Scale:{scale}')